@@ -1,15 +1,25 @@
 # COOL_CRAFT_WEBAPP.py
 import streamlit as st
 import pandas as pd
+import numpy as np
 import os
 import io
+import hashlib
 import re
-from math import ceil
+import itertools
+import functools
+from dataclasses import dataclass
 from datetime import datetime
 from openpyxl import Workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.cell.cell import MergedCell
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle, DEFAULT_FONT
+
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
 
 # ================ PAGE SETUP ================
 st.set_page_config(page_title="CoolCraft VRF TDS Generator", layout="wide")
@@ -37,55 +47,122 @@ DATA_SOURCES = {
 KW_TO_HP = 1.0 / 0.745699872
 TON_TO_HP = 3.517 / 0.745699872
 
+RATING_CSS = ['background-color: #c0392b; color:white',
+              'background-color: #f39c12; color:white',
+              'background-color: #1e824c; color:white']
+RATING_THRESHOLDS = [70, 90]
+STYLE_MAX_ROWS = 200
+
+_WS_RE = re.compile(r'\s+')
+_TOKEN_RE = re.compile(r'[a-z]+|[0-9]+')
+# zero-width space and BOM vanish; a non-breaking space becomes a plain one so words don't fuse
+_ZW_TABLE = str.maketrans({'\u200b': None, '\ufeff': None, '\u00a0': ' '})
+
+# ================ EXCEL STYLES ================
+_THIN = Side(border_style="thin", color="000000")
+_BORDER_ALL = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
+_CENTER = Alignment(horizontal='center', vertical='center')
+_HDR_FONT = Font(bold=True, color='FFFFFF')
+_TITLE_FONT = Font(size=14, bold=True, color="FFFFFF")
+_FILLS = {name: PatternFill(start_color=rgb, end_color=rgb, fill_type='solid') for name, rgb in (
+    ('title', '4B8BBE'), ('header', '2F5597'), ('even', 'EAF1FB'), ('odd', 'FFFFFF'),
+    ('green', '1e824c'), ('amber', 'f39c12'), ('red', 'c0392b'),
+)}
+# indexed by export_rating_codes(); the row's banding style is appended so code -1 picks it
+_RATING_STYLES = ('tds_red', 'tds_amber', 'tds_green')
+
 # ================ HELPERS ================
-@st.cache_data(ttl=600)
-def load_excel_all_sheets(path: str):
+def file_digest(path: str):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as fh:
+        return hashlib.blake2b(fh.read(), digest_size=16).hexdigest()
+
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    # repetitive text (power supply, colour, ...) becomes categorical; floats stay float64 so capacities keep exact values
+    for c in df.select_dtypes(include=['object', 'string']).columns:
+        # mixed number/text columns stay object; Arrow cannot serialise mixed categories
+        if pd.api.types.infer_dtype(df[c], skipna=True) != 'string':
+            continue
+        if df[c].nunique() / max(1, len(df)) < 0.5:
+            df[c] = df[c].astype('category')
+    for c in df.select_dtypes(include='integer').columns:
+        df[c] = pd.to_numeric(df[c], downcast='integer')
+    return df
+
+# file_key is the content digest, so edited workbooks get a fresh entry and unchanged ones never expire
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_excel_all_sheets(path: str, file_key: str):
     if os.path.exists(path):
-        return pd.read_excel(path, sheet_name=None)
+        try:
+            sheets = pd.read_excel(path, sheet_name=None, engine=EXCEL_ENGINE)
+        except Exception:
+            if EXCEL_ENGINE == "openpyxl":
+                raise
+            # calamine rejects a few workbooks (odd styles, broken shared strings) that openpyxl still reads
+            sheets = pd.read_excel(path, sheet_name=None, engine="openpyxl")
+        return {name: compact_dtypes(sheet) for name, sheet in sheets.items()}
     else:
         st.error(f"Excel file not found at {path}")
         st.stop()
 
+@functools.lru_cache(maxsize=4096)
 def normalize_name(s: str) -> str:
     if s is None:
         return ""
-    s = str(s).strip().lower()
-    s = re.sub(r'\s+', ' ', s)
-    s = s.replace('\u200b', '')
-    return s
-
-def build_normalized_map(df: pd.DataFrame) -> dict:
-    return {orig: normalize_name(orig) for orig in df.columns}
-
-def find_capacity_column_by_type(df: pd.DataFrame, unit_type: str) -> str:
-    norm_map = build_normalized_map(df)
-    if unit_type.lower() == "indoor":
-        for orig, norm in norm_map.items():
-            if "cooling capacity" in norm and "kw" in norm:
-                return orig
-        for orig, norm in norm_map.items():
-            if "capacity" in norm and "kw" in norm:
-                return orig
-        for orig, norm in norm_map.items():
-            if "kw" in norm:
-                return orig
-    else:  # outdoor
-        for orig, norm in norm_map.items():
-            if "hp" in norm and ("capacity" in norm or "hp" in norm):
-                return orig
-        for orig, norm in norm_map.items():
-            if "horsepower" in norm or re.search(r'\bhp\b', norm):
-                return orig
-        for orig, norm in norm_map.items():
-            if "capacity" in norm and ("hp" in norm or "horsepower" in norm):
-                return orig
-    return None
+    return _WS_RE.sub(' ', str(s).translate(_ZW_TABLE).strip().lower())
+
+# token sets tried in priority order; the first rule with a match wins, earliest column first
+CAPACITY_RULES = {
+    "indoor": [("cooling", "capacity", "kw"), ("capacity", "kw"), ("kw",)],
+    "outdoor": [("hp",), ("horsepower",)],
+}
+
+@st.cache_data(show_spinner=False)
+def find_capacity_column_by_type(cols: tuple, unit_type: str) -> str:
+    rules = CAPACITY_RULES["indoor" if unit_type.lower() == "indoor" else "outdoor"]
+    best_col, best_score = None, 0
+    for orig in cols:
+        tokens = set(_TOKEN_RE.findall(normalize_name(orig)))
+        score = next((len(rules) - i for i, rule in enumerate(rules) if tokens.issuperset(rule)), 0)
+        # strictly greater, so the earliest column wins a tie
+        if score > best_score:
+            best_col, best_score = orig, score
+            if score == len(rules):
+                break
+    return best_col
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def analyze_sheet(path: str, file_key: str, sheet_name: str, unit_type: str):
+    df = load_excel_all_sheets(path, file_key)[sheet_name]
+    cap_col = find_capacity_column_by_type(tuple(df.columns), unit_type)
+    if cap_col is None:
+        return None, None, []
+    cap_index = CapIndex.build(pd.to_numeric(df[cap_col], errors='coerce').to_numpy(dtype=np.float64))
+    sizes_available = np.unique(cap_index.sorted_vals).tolist()
+    return cap_col, cap_index, sizes_available
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def sheet_numeric_columns(path: str, file_key: str, sheet_name: str, cap_col: str = None) -> list:
+    df = load_excel_all_sheets(path, file_key)[sheet_name]
+    numeric = set(df.select_dtypes(include=['number']).columns)
+    # the page shows the capacity column coerced to float, even when the sheet stores placeholders like '-'
+    return [c for c in df.columns if c in numeric or c == cap_col]
+
+def size_key(s):
+    # whole sizes label as "20HP" rather than "20.0HP"
+    return int(s) if float(s).is_integer() else float(s)
+
+def describe_combo(combo, unit_label: str) -> str:
+    return " + ".join(f"{v}×{k}{unit_label}" for k, v in combo.items())
+
+def instance_rows(df: pd.DataFrame, idx_list) -> pd.DataFrame:
+    rows = df.iloc[idx_list].reset_index(drop=True)
+    rows['_instance'] = np.arange(1, len(rows) + 1)
+    return rows
 
 def expand_combo_instances(combo):
-    inst = []
-    for hp, cnt in sorted(combo.items(), reverse=True):
-        inst.extend([hp] * cnt)
-    return inst
+    return itertools.chain.from_iterable(itertools.repeat(hp, cnt) for hp, cnt in sorted(combo.items(), reverse=True))
 
 def greedy_combo_exact_first(target_cap, sizes):
     if target_cap in sizes:
@@ -102,76 +179,173 @@ def greedy_combo_exact_first(target_cap, sizes):
         combo[smallest] = combo.get(smallest, 0) + 1
     return combo
 
+def combo_total(combo) -> float:
+    return sum(k * v for k, v in combo.items())
+
+def combo_totals(combo):
+    return combo_total(combo), sum(combo.values())
+
 def generate_candidate_combos(target_cap, sizes, max_suggestions=12):
+    """Candidate combos best-first, as (combo, total_cap, units) tuples."""
     raw = [greedy_combo_exact_first(target_cap, sizes)]
-    for s in sizes[:6]:
-        raw.append({s: ceil(target_cap / s)})
+    top = sizes[:6]
+    counts = np.ceil(target_cap / np.asarray(top, dtype=np.float64)).astype(int)
+    raw.extend({s: n} for s, n in zip(top, counts.tolist()))
     uniq = {tuple(sorted(c.items(), reverse=True)): c for c in raw}
-    combos = list(uniq.values())[:max_suggestions]
-    scored = []
-    for c in combos:
-        total = sum(expand_combo_instances(c))
-        units = sum(c.values())
-        closeness = 1.0 / (1 + abs(total - target_cap) / max(1, target_cap))
-        unit_score = 1.0 / (1 + units)
-        score = 0.6 * closeness + 0.4 * unit_score
-        scored.append((score, c))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [c for _, c in scored]
-
-def find_nearest_row(df, target_val, cap_col):
-    diffs = (pd.to_numeric(df[cap_col], errors='coerce') - float(target_val)).abs()
-    idx = diffs.idxmin()
-    return df.loc[idx] if pd.notna(idx) else None
-
-def export_excel(df: pd.DataFrame, sheet_name='VRF_TDS_Report'):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = sheet_name
-    thin = Side(border_style="thin", color="000000")
-    border_all = Border(left=thin, right=thin, top=thin, bottom=thin)
-    center_align = Alignment(horizontal='center', vertical='center')
-    header_font = Font(bold=True, color='FFFFFF')
-
+    candidates = [(c, *combo_totals(c)) for c in list(uniq.values())[:max_suggestions]]
+    # rounded so combos with the same real total tie exactly instead of on float summation noise
+    totals = np.round([total for _, total, _ in candidates], 6)
+    units = np.array([n for _, _, n in candidates], dtype=np.float64)
+    closeness = 1.0 / (1 + np.abs(totals - target_cap) / max(1, target_cap))
+    scores = 0.6 * closeness + 0.4 * (1.0 / (1 + units))
+    # stable so equally scored combos keep their generation order
+    order = np.argsort(-scores, kind='stable')
+    return [candidates[i] for i in order]
+
+@dataclass(frozen=True)
+class CapIndex:
+    """Float capacity column plus its NaN-free stable sort order, built once per sheet."""
+    values: np.ndarray
+    order: np.ndarray
+    sorted_vals: np.ndarray
+    exact: dict  # capacity -> every row position holding it, in sheet order
+
+    @classmethod
+    def build(cls, values: np.ndarray) -> "CapIndex":
+        valid = np.flatnonzero(~np.isnan(values))
+        order = valid[np.argsort(values[valid], kind='stable')]
+        exact = pd.Series(values).groupby(values, sort=False).indices
+        return cls(values, order, values[order], exact)
+
+    def lookup(self, targets) -> np.ndarray:
+        """Exact capacity hits come from the dict; only the misses go through nearest()."""
+        targets = np.asarray(targets, dtype=np.float64)
+        empty = (-1,)
+        idx = np.fromiter((self.exact.get(t, empty)[0] for t in targets.tolist()), dtype=np.intp, count=targets.size)
+        miss = idx < 0
+        if miss.any():
+            idx[miss] = self.nearest(targets[miss])
+        return idx
+
+    def nearest(self, targets) -> np.ndarray:
+        """Positional index of the closest capacity row for every target.
+
+        Ties resolve to the earliest row, matching an exact-match-first, then idxmin lookup.
+        """
+        targets = np.asarray(targets, dtype=np.float64)
+        order, sorted_vals = self.order, self.sorted_vals
+        pos = np.searchsorted(sorted_vals, targets)
+        right = np.minimum(pos, len(order) - 1)
+        left = np.maximum(pos - 1, 0)
+        # step back to the first row of the left neighbour's run of equal capacities
+        left = np.searchsorted(sorted_vals, sorted_vals[left])
+        d_left = np.abs(sorted_vals[left] - targets)
+        d_right = np.abs(sorted_vals[right] - targets)
+        pick_left = (d_left < d_right) | ((d_left == d_right) & (order[left] < order[right]))
+        return np.where(pick_left, order[left], order[right])
+
+def rating_styles(col: pd.Series) -> np.ndarray:
+    arr = col.to_numpy(dtype=np.float64, na_value=np.nan)
+    css = np.take(RATING_CSS, np.digitize(arr, RATING_THRESHOLDS))
+    # blanks stay unstyled in the preview
+    css[np.isnan(arr)] = ''
+    return css
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def compute_enriched(path: str, file_key: str, sheet_name: str, unit_type: str, target_cap: float):
+    df = load_excel_all_sheets(path, file_key)[sheet_name]
+    cap_col, cap_index, sizes_available = analyze_sheet(path, file_key, sheet_name, unit_type)
+    normalized_sizes = [size_key(s) for s in reversed(sizes_available)]
+
+    candidates = generate_candidate_combos(target_cap, normalized_sizes)
+    targets = np.fromiter(itertools.chain.from_iterable(expand_combo_instances(c) for c, _, _ in candidates),
+                          dtype=np.float64)
+    row_idx = cap_index.lookup(targets)
+    offsets = list(itertools.accumulate(units for _, _, units in candidates))
+    enriched = []
+    for (combo, _, units), start, end in zip(candidates, [0] + offsets, offsets):
+        idx_list = row_idx[start:end]
+        rows = instance_rows(df, idx_list)
+        if not pd.api.types.is_numeric_dtype(rows[cap_col]):
+            rows[cap_col] = cap_index.values[idx_list]
+        enriched.append({'combo': combo, 'rows': rows, 'row_idx': idx_list, 'cap_field': cap_col,
+                         'source': (path, file_key, sheet_name, unit_type),
+                         'total_cap': pd.to_numeric(rows[cap_col], errors='coerce').sum(),
+                         'units': units})
+    return enriched
+
+def column_widths(df: pd.DataFrame, title: str = "") -> list:
+    widths = np.asarray(df.columns.astype(str).str.len(), dtype=np.int64)
+    if len(df):
+        data_widths = [df.iloc[:, i].astype(str).str.len().max() for i in range(df.shape[1])]
+        widths = np.maximum(widths, np.asarray(data_widths, dtype=np.int64))
+    if widths.size:
+        # the merged title sits in column A
+        widths[0] = max(widths[0], len(title))
+    return np.minimum(widths + 3, 50).tolist()
+
+def export_rating_codes(col: pd.Series) -> np.ndarray:
+    """Per-cell export rating: 0 red, 1 amber, 2 green, -1 for cells that keep the row banding."""
+    if isinstance(col.dtype, np.dtype) and col.dtype.kind in 'biuf':
+        arr = col.to_numpy(dtype=np.float64)
+        is_num = np.ones(arr.shape, dtype=bool)
+    else:
+        # text and nullable columns can still carry stray numbers (and NaN blanks), rated like any number
+        vals = col.tolist()
+        is_num = np.fromiter((isinstance(v, (int, float)) for v in vals), dtype=bool, count=len(vals))
+        arr = np.array([v if n else np.nan for v, n in zip(vals, is_num)], dtype=np.float64)
+    # NaN compares below every threshold, so it rates red
+    codes = np.where(np.isnan(arr), 0, np.digitize(arr, RATING_THRESHOLDS))
+    return np.where(is_num, codes, -1)
+
+def add_tds_styles(wb: Workbook) -> None:
+    wb.add_named_style(NamedStyle(name='tds_title', font=_TITLE_FONT, fill=_FILLS['title'], alignment=_CENTER))
+    wb.add_named_style(NamedStyle(name='tds_header', font=_HDR_FONT, fill=_FILLS['header'],
+                                  alignment=_CENTER, border=_BORDER_ALL))
+    for name in ('even', 'odd', 'green', 'amber', 'red'):
+        wb.add_named_style(NamedStyle(name=f'tds_{name}', font=DEFAULT_FONT, fill=_FILLS[name], border=_BORDER_ALL))
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def export_excel(df: pd.DataFrame, sheet_name='VRF_TDS_Report') -> bytes:
+    wb = Workbook(write_only=True)
+    add_tds_styles(wb)
+    ws = wb.create_sheet(sheet_name)
+    title = "❄️ CoolCraft Technical Data Sheet (TDS)"
     col_count = df.shape[1] if df.shape[1] > 0 else 1
-    ws.merge_cells(start_row=1, start_column=1, end_row=1, end_column=col_count)
-    title_cell = ws.cell(row=1, column=1, value="❄️ CoolCraft Technical Data Sheet (TDS)")
-    title_cell.font = Font(size=14, bold=True, color="FFFFFF")
-    title_cell.alignment = center_align
-    title_cell.fill = PatternFill(start_color='4B8BBE', end_color='4B8BBE', fill_type='solid')
-
-    for r_idx, row in enumerate(dataframe_to_rows(df, index=False, header=True), start=2):
-        for c_idx, value in enumerate(row, start=1):
-            cell = ws.cell(row=r_idx, column=c_idx, value=value)
-            if r_idx == 2:
-                cell.font = header_font
-                cell.fill = PatternFill(start_color='2F5597', end_color='2F5597', fill_type='solid')
-                cell.alignment = center_align
-            else:
-                fill_color = "EAF1FB" if r_idx % 2 == 0 else "FFFFFF"
-                if isinstance(value, (int, float)):
-                    if value >= 90:
-                        fill_color = "1e824c"
-                    elif value >= 70:
-                        fill_color = "f39c12"
-                    else:
-                        fill_color = "c0392b"
-                cell.fill = PatternFill(start_color=fill_color, end_color=fill_color, fill_type='solid')
-            cell.border = border_all
-
-    for col_cells in ws.columns:
-        length = max(len(str(cell.value or "")) for cell in col_cells)
-        first_cell = next((cell for cell in col_cells if not isinstance(cell, MergedCell)), None)
-        if first_cell:
-            try:
-                ws.column_dimensions[first_cell.column_letter].width = min(length + 3, 50)
-            except Exception:
-                pass
+
+    # column widths have to be set before the first row is streamed
+    for c_idx, width in enumerate(column_widths(df, title), start=1):
+        ws.column_dimensions[get_column_letter(c_idx)].width = width
+
+    title_cell = WriteOnlyCell(ws, value=title)
+    title_cell.style = 'tds_title'
+    ws.append([title_cell] + [None] * (col_count - 1))
+    ws.merged_cells.add(f"A1:{get_column_letter(col_count)}1")
+
+    header_row = []
+    for value in df.columns:
+        cell = WriteOnlyCell(ws, value=value)
+        cell.style = 'tds_header'
+        header_row.append(cell)
+    ws.append(header_row)
+
+    codes = np.full(df.shape, -1, dtype=np.int8)
+    for c_idx in range(df.shape[1]):
+        codes[:, c_idx] = export_rating_codes(df.iloc[:, c_idx])
+
+    rows = zip(df.itertuples(index=False, name=None), codes.tolist())
+    for r_idx, (row, row_codes) in enumerate(rows, start=3):
+        row_styles = _RATING_STYLES + ('tds_even' if r_idx % 2 == 0 else 'tds_odd',)
+        cells = []
+        for value, code in zip(row, row_codes):
+            cell = WriteOnlyCell(ws, value=value)
+            cell.style = row_styles[code]
+            cells.append(cell)
+        ws.append(cells)
 
     bio = io.BytesIO()
     wb.save(bio)
-    bio.seek(0)
-    return bio
+    return bio.getvalue()
 
 # ================ SIDEBAR / WIZARD ================
 st.sidebar.header("Start New TDS")
@@ -210,18 +384,22 @@ if not path:
     st.error("No mapping found for this selection. Check DATA_SOURCES mapping.")
     st.stop()
 
-sheets = load_excel_all_sheets(path)
+file_key = file_digest(path)
+sheets = load_excel_all_sheets(path, file_key)
 sheet_choice = st.selectbox("Select sheet", list(sheets)) if len(sheets) > 1 else list(sheets)[0]
-df = sheets[sheet_choice].copy()
+# cache_data already returns a private copy, so the capacity column can be coerced below without a .copy()
+df = sheets[sheet_choice]
 
 cap_label_type = "HP" if wizard['unit_type']=="Outdoor" else "kW"
-cap_col = find_capacity_column_by_type(df, wizard['unit_type'])
+cap_col, cap_index, sizes_available = analyze_sheet(path, file_key, sheet_choice, wizard['unit_type'])
+# saved options carry this, so their row positions are only reused against the sheet they came from
+source = (path, file_key, sheet_choice, wizard['unit_type'])
 if cap_col is None:
     st.warning(f"No capacity column ({cap_label_type}) found. Automatic combo disabled.")
-    sizes_available = []
-else:
-    df[cap_col] = pd.to_numeric(df[cap_col], errors='coerce')
-    sizes_available = sorted(list({float(x) for x in df[cap_col].dropna().unique()}))
+elif not pd.api.types.is_numeric_dtype(df[cap_col]):
+    # text placeholders ('-') kept the column as object; show and export the coerced capacities
+    # the lookups use, so those cells go blank and the column is still rated
+    df[cap_col] = cap_index.values
 
 st.subheader("Loaded Dataset Preview")
 st.dataframe(df.head())
@@ -240,23 +418,7 @@ if wizard['combination_mode'] == "Automatic":
             else:
                 target_cap = load_val if unit_input=="kW" else load_val*0.745699872 if unit_input=="HP" else load_val*3.517
 
-            enriched = []
-            sizes_desc = sorted(sizes_available, reverse=True)
-            normalized_sizes = [int(s) if float(s).is_integer() else float(s) for s in sizes_desc]
-
-            for combo in generate_candidate_combos(target_cap, normalized_sizes):
-                rows = []
-                for idx, cap in enumerate(expand_combo_instances(combo)):
-                    exact = df[pd.to_numeric(df[cap_col], errors='coerce') == float(cap)]
-                    if not exact.empty:
-                        chosen = exact.iloc[0].to_dict()
-                    else:
-                        nearest = find_nearest_row(df, cap, cap_col)
-                        chosen = nearest.to_dict() if nearest is not None else {}
-                    chosen['_instance'] = idx + 1
-                    rows.append(chosen)
-                total_cap = sum(pd.to_numeric([r.get(cap_col, 0) for r in rows], errors='coerce'))
-                enriched.append({'combo': combo, 'rows': rows, 'total_cap': total_cap, 'units': len(rows)})
+            enriched = compute_enriched(path, file_key, sheet_choice, wizard['unit_type'], target_cap)
             st.session_state['enriched'] = enriched
 else:
     man_in = st.text_input(f"Enter {cap_label_type} sizes (use +, e.g. 3.5+3.5+2)", "")
@@ -270,72 +432,82 @@ else:
                 st.error("Could not parse manual sizes. Use numbers separated by +.")
                 sizes = []
             if sizes:
-                rows = []
-                for idx, cap in enumerate(sizes):
-                    if cap_col is not None:
-                        exact = df[pd.to_numeric(df[cap_col], errors='coerce') == float(cap)]
-                        if not exact.empty:
-                            chosen = exact.iloc[0].to_dict()
-                        else:
-                            nearest_row = find_nearest_row(df, cap, cap_col)
-                            chosen = nearest_row.to_dict() if nearest_row is not None else {'_cap_input': cap}
-                    else:
-                        chosen = {'_cap_input': cap}
-                    chosen['_instance'] = idx + 1
-                    rows.append(chosen)
+                if cap_col is not None and cap_index.order.size:
+                    idx_list = cap_index.lookup(sizes)
+                    rows = instance_rows(df, idx_list)
+                else:
+                    idx_list = None
+                    rows = pd.DataFrame({'_cap_input': sizes, '_instance': np.arange(1, len(sizes) + 1)})
                 combo_dict = {}
                 for s in sizes:
-                    key = int(s) if float(s).is_integer() else s
+                    key = size_key(s)
                     combo_dict[key] = combo_dict.get(key, 0) + 1
-                st.session_state['enriched'] = [{'combo': combo_dict, 'rows': rows, 'total_cap': sum(sizes), 'units': len(rows)}]
+                st.session_state['enriched'] = [{'combo': combo_dict, 'rows': rows, 'row_idx': idx_list,
+                                                 'cap_field': cap_col if idx_list is not None else '_cap_input',
+                                                 'source': source, 'total_cap': sum(sizes), 'units': len(rows)}]
 
 # ================ SHOW & EXPORT ================
 if 'enriched' in st.session_state:
     enriched = st.session_state['enriched']
     for i, e in enumerate(enriched, 1):
-        desc = " + ".join(f"{v}×{k}{cap_label_type}" for k, v in e['combo'].items())
+        desc = describe_combo(e['combo'], cap_label_type)
         st.markdown(f"**Option {i}**: {desc} — Units: {e.get('units',0)} — Total: {round(e.get('total_cap',0), 3)} {cap_label_type}")
-        st.dataframe(pd.DataFrame(e['rows']).head(10))
+        st.dataframe(e['rows'].head(10))
 
     choice = st.selectbox("Choose option", range(1, len(enriched) + 1)) - 1
     chosen = enriched[choice]
 
-    mod_rows = []
-    for r in chosen['rows']:
-        inst = int(r.get('_instance', 0))
-        sel_row = r.copy()
-        if 'model' in df.columns and cap_col in r and pd.notna(r.get(cap_col, None)):
-            model_list = df[pd.to_numeric(df[cap_col], errors='coerce') == float(r[cap_col])]['model'].dropna().unique().tolist()
+    rows = chosen['rows']
+    from_catalog = chosen.get('row_idx') is not None
+    # after a sheet/product/unit switch the saved positions point into another workbook,
+    # so such an option is shown and exported from its own stored rows
+    same_sheet = chosen.get('source') == source
+    instance_view = rows[['_instance', chosen['cap_field']]].assign(_pos=chosen.get('row_idx'))
+    # overrides index the current sheet's CapIndex, so stale positions never reach it
+    has_models = from_catalog and same_sheet and 'model' in df.columns
+    if has_models:
+        models = df['model']
+        model_first_row = {}
+        for pos, m in enumerate(models.tolist()):
+            model_first_row.setdefault(m, pos)
+    sel_idx = []
+    for inst, cap, row_pos in instance_view.itertuples(index=False, name=None):
+        if has_models and not np.isnan(cap_index.values[row_pos]):
+            same_cap = cap_index.exact[cap_index.values[row_pos]]
+            model_list = models.iloc[same_cap].dropna().unique().tolist()
             if not model_list:
-                model_list = df['model'].dropna().unique().tolist()
+                model_list = models.dropna().unique().tolist()
             model_list = sorted(model_list)
             sel = st.selectbox(f"Instance {inst}", model_list, key=f"ov_{inst}")
-            matches = df[df['model'] == sel]
-            if not matches.empty:
-                sel_row = matches.iloc[0].to_dict()
-                sel_row['_instance'] = inst
+            row_pos = model_first_row.get(sel, row_pos)
         else:
-            cap_display = r.get(cap_col, r.get('_cap_input', 'N/A'))
-            st.markdown(f"Instance {inst} — {cap_label_type}: {cap_display}")
-            sel_row['_instance'] = inst
-        mod_rows.append(sel_row)
+            st.markdown(f"Instance {inst} — {cap_label_type}: {cap}")
+        sel_idx.append(row_pos)
 
-    out_df = pd.DataFrame(mod_rows)
+    if from_catalog and same_sheet:
+        out_df = df.iloc[sel_idx].reset_index(drop=True)
+        out_df['_instance'] = rows['_instance']
+    else:
+        # assign() below returns a new frame, so the session rows are never mutated
+        out_df = rows
 
     # metadata
     client = st.text_input("Client Name", "Client")
     manuf = st.text_input("Manufacturer", wizard['brand'])
     billing = st.text_input("Billing/Sales", "")
     rdate = st.date_input("Report Date", datetime.now().date())
-    out_df['Client'] = client
-    out_df['Manufacturer'] = manuf
-    out_df['BillingSales'] = billing
-    out_df['ReportDate'] = rdate.strftime('%Y-%m-%d')
-    out_df['SelectedCombo'] = " + ".join(f"{v}×{k}{cap_label_type}" for k, v in chosen['combo'].items())
-    out_df[f'ComboTotal{cap_label_type}'] = chosen.get('total_cap', 0)
-    out_df['ComboUnits'] = chosen.get('units', 0)
-
-    meta_cols = ['Client', 'Manufacturer', 'BillingSales', 'ReportDate', 'SelectedCombo', f'ComboTotal{cap_label_type}', 'ComboUnits']
+    meta = {
+        'Client': client,
+        'Manufacturer': manuf,
+        'BillingSales': billing,
+        'ReportDate': rdate.strftime('%Y-%m-%d'),
+        'SelectedCombo': describe_combo(chosen['combo'], cap_label_type),
+        f'ComboTotal{cap_label_type}': chosen.get('total_cap', 0),
+        'ComboUnits': chosen.get('units', 0),
+    }
+    out_df = out_df.assign(**meta)
+
+    meta_cols = list(meta)
     extra_cols = [c for c in df.columns if c in out_df.columns and c not in meta_cols]
     if extra_cols:
         final_cols = meta_cols + extra_cols
@@ -347,18 +519,15 @@ if 'enriched' in st.session_state:
         out_df = out_df[meta_cols + [c for c in out_df.columns if c not in meta_cols]]
 
     st.subheader("TDS Preview with Ratings")
-    num_cols = list(out_df.select_dtypes(include=['number']).columns)
-    def style_func(x):
-        if isinstance(x, (int, float)):
-            if x >= 90:
-                return 'background-color: #1e824c; color:white'
-            elif x >= 70:
-                return 'background-color: #f39c12; color:white'
-            else:
-                return 'background-color: #c0392b; color:white'
-        return ''
-    if num_cols:
-        st.dataframe(out_df.style.applymap(style_func, subset=num_cols))
+    if from_catalog and same_sheet:
+        num_cols = [c for c in sheet_numeric_columns(path, file_key, sheet_choice, cap_col) if c not in meta_cols]
+    else:
+        # manual-input and stale option rows don't follow this sheet's columns
+        num_cols = [c for c in out_df.select_dtypes(include=['number']).columns if c not in meta_cols]
+    num_cols = [f'ComboTotal{cap_label_type}', 'ComboUnits'] + num_cols
+    # a styled frame ships per-cell CSS to the browser, so large tables go out plain
+    if num_cols and len(out_df) <= STYLE_MAX_ROWS:
+        st.dataframe(out_df.style.apply(rating_styles, axis=0, subset=num_cols))
     else:
         st.dataframe(out_df)
 